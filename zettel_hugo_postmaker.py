@@ -1,27 +1,91 @@
 #!/usr/bin/env python
 
+import concurrent.futures
+import dataclasses
+import fnmatch
+import functools
+import hashlib
 import logging
 import pathlib
 import configargparse
 import sys
 import os
+import signal
 import stat
+import subprocess
 import time
-from sultan.api import Sultan
+import sqlite3
+import typing
 import regex
 
+# Location of the script, used to find the default configuration file and directories
+_SCRIPT_PATH = pathlib.Path(__file__)
+_SCRIPT_STEM = _SCRIPT_PATH.stem
+_SCRIPT_DIR = _SCRIPT_PATH.parent
+
 # Configure logging early
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
+# Patterns used by modify_links() are compiled once at import time rather than on every file. They are only applied to
+# text outside of fenced & inline code blocks, see split_code().
+# We cannot support skipping code blocks beginning with 4 spaces/1 tab as pandoc conversion changes
+# Note-Link-Janitor links to use 4 spaces.
+_WIKILINK_RE = regex.compile(r'(\\\[\\\[(.*)\\\]\\\](?!\s\(|\())', flags=regex.VERSION1)
+# Finds  references that are in style \[\[foo\]\] only by excluding links in style \[\[foo\]\](bar) or
+# \[\[foo\]\] (bar). Capture group $2 returns just foo
+_NUMBERED_LINK_RE = regex.compile(r'(\[(\d+)\](\()(.*)(?=\))\))', flags=regex.VERSION1)
+# Finds only references in style [123](bar). Capture group $2 returns 123 and capture group $4 returns bar
+_NUMBERED_WIKILINK_RE = regex.compile(r'(\\\[\\\[(\d+)\\\]\\\](\s\(|\()(.*)\))', flags=regex.VERSION1)
+# Finds only references in style \[\[123\]\] (bar). Capture group $2 returns 123 and capture group $4 returns bar
+
+
+@dataclasses.dataclass(frozen=True)
+class Config:
+    """
+    Parameters for the script as resolved by parse_config() from the command-line and configuration file. The
+    parameters are resolved once per run and cannot be changed afterwards.
+    """
+    config_file: str
+    source_files: typing.Union[str, pathlib.Path]
+    target_files: str
+    process_images: str
+    img_inputs: typing.Optional[typing.List[str]]
+    img_output: typing.Optional[str]
+    filters: typing.Optional[typing.List[str]]
+    citations: bool
+    bib_file: typing.Optional[str]
+    csl_file: typing.Optional[str]
+    metafile: typing.Optional[str]
+    log_file: typing.Optional[str]
+    process_type: str
+    modified_time: int
+    watch_interval: int
+    use_cache: str
+
+
+def add_file_logger(log_file):
+    """
+    Function to add a handler to the root logger which writes log messages to a file.
+
+    :param log_file: Path to log file.
+    :return: None
+    """
+    filelogger = logging.FileHandler('{0}'.format(log_file))
+    filelogformatter = logging.Formatter(
+        '%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+    filelogger.setFormatter(filelogformatter)
+    logging.getLogger().addHandler(filelogger)
+
 
 def parse_config():
-    default_config = pathlib.Path(__file__).stem + '.ini'
+    default_config = _SCRIPT_STEM + '.ini'
     config = configargparse.ArgParser(default_config_files=[default_config])
     config.add_argument('-c', '--config', is_config_file=True,
                         help='Specify path to Configuration file. Default is {0}.ini'.format(
-                            pathlib.Path(__file__).stem), metavar='CONFIG'
+                            _SCRIPT_STEM), metavar='CONFIG'
                         )
     config.add_argument('-v', '--verbosity', action='store',
                         help='Specify logging level for script. Default is %(default)s.',
@@ -35,7 +99,7 @@ def parse_config():
                              'Spaces are allowed in paths. Use double quotes for paths with spaces when specifying '
                              'paths on the command line only. The script will handle paths with spaces in the config '
                              'file automatically. ',
-                        default=pathlib.Path.joinpath(pathlib.Path(__file__).parent, 'source'),
+                        default=pathlib.Path.joinpath(_SCRIPT_DIR, 'source'),
                         metavar='DIRECTORY')
     config.add_argument('--target_files', action='store',
                         help='Specify path to posts directory in Hugo site where processed markdown files should be '
@@ -94,36 +158,49 @@ def parse_config():
                              'included in every markdown file while being processed in pandoc. Use double quotes for '
                              'paths with spaces when specifying paths on the command line only. The script will '
                              'handle paths with spaces in the config file automatically. ', metavar='FILE')
+    config.add_argument('--cache', action='store',
+                        help='Specify whether the output from pandoc should be cached so that source markdown files '
+                             'which have not changed since the last run are not processed by pandoc again. The cache '
+                             'is stored in the resources directory of the Hugo site. The cache is not used when '
+                             '--images is set to yes. Default is %(default)s.',
+                        choices=['yes', 'no'],
+                        default='yes')
     config.add_argument('-p', '--process', action='store',
-                        help='Determine whether to process all source files or only recently modified files. Default '
-                             'is %(default)s.',
-                        choices=['all', 'modified'],
+                        help='Determine whether to process all source files or only recently modified files. With '
+                             '"watch", all source files are processed and the script then keeps processing files as '
+                             'they are modified until it is stopped with Ctrl+C. Default is %(default)s.',
+                        choices=['all', 'modified', 'watch'],
                         default='all')
     config.add_argument('-m', '--modified', action='store', type=int,
                         help='Specify in minutes what is the time limit for recently modified files. Default is '
                              '%(default)s.',
                         default=60, metavar='MINUTES')
-
-    options = config.parse_known_args()
-    # Convert tuple of parsed arguments into a dictionary. There are two values within this tuple.
-    # [0] represents recognized arguments. [1] represents unrecognized arguments on command-line or config file.
-    option_values = vars(options[0])
-    # Assign dictionary values to variables.
-    config_file = option_values.get('config')
-    source_files = option_values.get('source_files')
-    target_files = option_values.get('target_files')
-    process_images = option_values.get('images')
-    img_inputs = option_values.get('images_in')
-    img_output = option_values.get('images_out')
-    filters = option_values.get('filters')
-    citations = option_values.get('cite')
-    bib_file = option_values.get('bib')
-    csl_file = option_values.get('csl')
-    metafile = option_values.get('metafile')
-    logging_level = option_values.get('verbosity')
-    log_file = option_values.get('file')
-    process_type = option_values.get('process')
-    modified_time = option_values.get('modified')
+    config.add_argument('--interval', action='store', type=int,
+                        help='Specify in seconds how often the source directory is checked for modified files when '
+                             'the script is set to watch the source directory. Default is %(default)s.',
+                        default=5, metavar='SECONDS')
+
+    # parse_known_args() returns a tuple of two values. [0] is a Namespace with the recognized arguments.
+    # [1] represents unrecognized arguments on command-line or config file, which we ignore.
+    options, _ = config.parse_known_args()
+    # Assign option values to variables.
+    config_file = options.config
+    source_files = options.source_files
+    target_files = options.target_files
+    process_images = options.images
+    img_inputs = options.images_in
+    img_output = options.images_out
+    filters = options.filters
+    citations = options.cite
+    bib_file = options.bib
+    csl_file = options.csl
+    metafile = options.metafile
+    use_cache = options.cache
+    logging_level = options.verbosity
+    log_file = options.file
+    process_type = options.process
+    modified_time = options.modified
+    watch_interval = options.interval
 
     # Reset logging levels as per config
     logger = logging.getLogger()
@@ -133,22 +210,17 @@ def parse_config():
     if log_file is None:
         logging.info('No log file set. All log messages will print to Console only')
     else:
-        filelogger = logging.FileHandler('{0}'.format(log_file))
-        filelogformatter = logging.Formatter(
-            '%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S')
-        filelogger.setFormatter(filelogformatter)
-        logger.addHandler(filelogger)
+        add_file_logger(log_file)
         logging.info('Outputting to log file')
 
     # Check if specified config file exists else bail
     if config_file is None:
         config_file = default_config
-        logging.debug('No configuration file specified. Using the default configuration file {}'.format(default_config))
+        logging.debug('No configuration file specified. Using the default configuration file %s', default_config)
     elif pathlib.Path(config_file).exists():
         logging.debug('Found configuration file %s', config_file)
     else:
-        logging.exception('Did not find the specified configuration file {}'.format(config_file))
+        logging.exception('Did not find the specified configuration file %s', config_file)
         raise FileNotFoundError
 
     # Check if somehow modified_time is set to NIL when processing modified files.
@@ -156,107 +228,108 @@ def parse_config():
         raise ValueError('Script is set to process only recently modified files. But the modified time parameter is '
                          'incorrectly defined.')
 
-    return config_file, source_files, target_files, process_images, img_inputs, img_output, filters, citations, \
-           bib_file, csl_file, metafile, log_file, process_type, modified_time
+    # Check that the interval for watching the source directory is at least one second.
+    if process_type == 'watch' and watch_interval < 1:
+        raise ValueError('Script is set to watch the source directory. But the interval parameter must be at least 1 '
+                         'second.')
+
+    return Config(config_file=config_file, source_files=source_files, target_files=target_files,
+                  process_images=process_images, img_inputs=img_inputs, img_output=img_output, filters=filters,
+                  citations=citations, bib_file=bib_file, csl_file=csl_file, metafile=metafile, log_file=log_file,
+                  process_type=process_type, modified_time=modified_time, watch_interval=watch_interval,
+                  use_cache=use_cache)
 
 
 def output_dir(target):
     """
     This function will check for the presence of a 'resources' directory,
-    which will be used later in the script to store the output from pandoc.
+    which will be used later in the script to store the cache of pandoc output.
 
     :param target: Path to directory within Hugo where processed markdown files are to be stored.
-    :return: Path to resource directory where intermediate markdown files should be stored.
+    :return: Path to resource directory where the cache of pandoc output should be stored.
     """
     temp_dir = pathlib.Path.joinpath(pathlib.Path(target).parents[1], 'resources')
-    if pathlib.Path(temp_dir).exists():
-        logging.debug('Found directory for storing temporary files')
+    if temp_dir.exists():
+        logging.debug('Found directory for storing the pandoc output cache')
     else:
-        print('Did not find the directory {} to store temporary output files. Will try create it now'.
+        print('Did not find the directory {} to store the pandoc output cache. Will try create it now'.
               format(temp_dir))
-        pathlib.Path(temp_dir).mkdir(exist_ok=True)
+        temp_dir.mkdir(exist_ok=True)
 
     return temp_dir
 
 
-def check_dirs(source_dir, target_dir, process_images, img_input_dir, img_output_dir):
+def check_dirs(cfg):
     """
     Function to check if specified directories exist. The function will create the destination directory if it does
     exist.
 
-    :param source_dir: Directory containing markdown files to be processed.
-    :param target_dir: Directory to store markdown files after they are processed.
-    :param process_images: Flag for whether images should be processed by the script
-    :param img_input_dir: Directory path(s) where images linked in source markdown files are stored.
-    :param img_output_dir: Directory to store images after they are extracted from source markdown files.
-    :return: Path to directory where temporary output file from run_pandoc() should be stored.
+    :param cfg: Parameters for the script from parse_config().
+    :return: Path to directory where the cache of pandoc output should be stored.
     """
-    if pathlib.Path(source_dir).exists():
+    source_dir = str(cfg.source_files)
+    target_dir = str(cfg.target_files)
+    src = pathlib.Path(source_dir)
+    tgt = pathlib.Path(target_dir)
+    img_out = pathlib.Path(str(cfg.img_output))
+
+    if src.exists():
         pass
-    elif source_dir == str(pathlib.Path.joinpath(pathlib.Path(__file__).parent, 'source')) and pathlib.Path(
-            source_dir).exists():
+    elif source_dir == str(pathlib.Path.joinpath(_SCRIPT_DIR, 'source')) and src.exists():
         print('No source directory found in specified configuration file. Using default {} instead'.format(source_dir))
     else:
-        logging.exception('Did not find the directory {}'.format(source_dir))
+        logging.exception('Did not find the directory %s', source_dir)
         raise NotADirectoryError
 
-    if pathlib.Path(target_dir).exists():
+    if tgt.exists():
         temp_dir = output_dir(target_dir)
     else:
         print('Did not find the target directory {}. Will try create it now'.format(target_dir))
-        pathlib.Path(target_dir).mkdir(exist_ok=True)
+        tgt.mkdir(exist_ok=True)
         temp_dir = output_dir(target_dir)
         # exist_ok=True will function like mkdir -p so there is no need to wrap this in a try-except block.
 
-    if process_images == 'yes':
-        for input_dir in (img_input_dir[0].split(',')):
+    if cfg.process_images == 'yes':
+        for input_dir in (cfg.img_inputs[0].split(',')):
             if pathlib.Path(input_dir).exists():
                 pass
             else:
-                logging.exception('Did not find the source image directory {}'.format(input_dir))
+                logging.exception('Did not find the source image directory %s', input_dir)
                 raise NotADirectoryError
 
-    if process_images == 'yes' and sys.platform != 'win32':
+    if cfg.process_images == 'yes':
+        # A single lstat() call tells us whether the image output directory exists and whether it is a link.
+        try:
+            img_out_stat = img_out.lstat()
+        except FileNotFoundError:
+            logging.exception('Did not find the directory %s', cfg.img_output)
+            raise NotADirectoryError
         # Checking for symlinks is unfortunately not consistent across OS'es so we have to make separate checks
-        # per-platform. The is_symlink check should work on any UNIX-y platform.
-        if pathlib.Path(img_output_dir).exists() and pathlib.Path(img_output_dir).is_symlink():
-            logging.debug('Target directory for storing extracted images is a symlink, which is ideal.')
-        elif pathlib.Path(img_output_dir).exists():
-            logging.warning('Image output directory exists but is an actual directory and not a symlink. This can '
-                            'result in broken links within processed Markdown files')
+        # per-platform. The S_ISLNK check should work on any UNIX-y platform.
+        if sys.platform != 'win32':
+            is_link = stat.S_ISLNK(img_out_stat.st_mode)
         else:
-            logging.exception('Did not find the directory {}'.format(img_output_dir))
+            # noinspection PyUnresolvedReferences
+            is_link = (img_out_stat.st_file_attributes & stat.FILE_ATTRIBUTE_REPARSE_POINT) != 0
+            # st_file_attributes is a bitmask, so junction links/directory links can have other attributes set as
+            # well as FILE_ATTRIBUTE_REPARSE_POINT (1024). For example, a directory link on Windows 10 returns 1040,
+            # i.e. FILE_ATTRIBUTE_DIRECTORY (16) | FILE_ATTRIBUTE_REPARSE_POINT.
+            # We only check for the reparse point bit.
+        if is_link and not img_out.exists():
+            # lstat() does not follow the link, so make sure that it is not a dangling link.
+            logging.exception('Did not find the directory %s', cfg.img_output)
             raise NotADirectoryError
-        if pathlib.Path(target_dir).root == pathlib.Path(img_output_dir).root:
-            logging.info('Target partition for processed markdown files and images is the same, which is ideal.')
+        elif is_link:
+            logging.debug('Target directory for storing extracted images is a symlink, which is ideal.')
         else:
-            logging.warning('Processed markdown files and extracted images are not being stored in the same '
-                            'partition. This can result in broken links within processed Markdown files.')
-    elif process_images == 'yes' and sys.platform == 'win32':
-        # noinspection PyUnresolvedReferences
-        if (pathlib.Path(img_output_dir).exists() and
-            pathlib.Path(img_output_dir).lstat().st_file_attributes == stat.FILE_ATTRIBUTE_REPARSE_POINT) \
-                or \
-                (pathlib.Path(img_output_dir).exists() and
-                 pathlib.Path(img_output_dir).lstat().st_file_attributes == 1040):
-            # Python docs (https://docs.python.org/3/library/stat.html#module-stat) state that st_file_attributes for
-            # junction links/directory links on Windows should be equal to FILE_ATTRIBUTE_REPARSE_POINT (1024).
-            # However, an empirical test shows that on Windows 10 (using ReFS instead of NTFS?),
-            # st_file_attributes returns a different value for junction links/directory links and so we add an extra
-            # 'magic value' check.
-            logging.debug('Target directory for storing extracted images exists and is a symlink, which is ideal.')
-        elif pathlib.Path(img_output_dir).exists():
             logging.warning('Image output directory exists but is an actual directory and not a symlink. This can '
                             'result in broken links within processed Markdown files')
-        else:
-            logging.exception('Did not find the directory %s', img_output_dir)
-            raise NotADirectoryError
-        if pathlib.Path(target_dir).root == pathlib.Path(img_output_dir).root:
+        if tgt.root == img_out.root:
             logging.info('Target partition for processed markdown files and images is the same, which is ideal.')
         else:
             logging.warning('Processed markdown files and extracted images are not being stored in the same '
                             'partition. This can result in broken links within processed Markdown files.')
-    elif process_images == 'no':
+    elif cfg.process_images == 'no':
         logging.debug('Skipping image processing checks.')
     else:
         logging.exception('Invalid parameter value for processing images')
@@ -265,275 +338,347 @@ def check_dirs(source_dir, target_dir, process_images, img_input_dir, img_output
     return temp_dir
 
 
-def check_files(filters, bibfile, cslfile, metafile):
+def check_file(file):
     """
-    Function to check if specified files exist.
+    Function to check if a specified file exists. The stat() result is returned rather than just a flag so that the
+    modification time of the file can be reused by the script.
 
-    :param filters: List of LUA filters to be included when running pandoc.
-    :param bibfile: Path to bibliography file.
-    :param cslfile: Path to Citation Language Style file.
-    :param metafile: Path to YAML file containing optional additional metadata.
-    :return: None
+    :param file: Path to file.
+    :return: Result of os.stat() for the file.
     """
-    filelist = [bibfile, cslfile]
+    # Files which are not specified come through as None, e.g. --bib or --csl missing from the configuration.
+    if file is None:
+        logging.error('Did not find the specified input file %s', file)
+        raise FileNotFoundError(file)
+    try:
+        file_stat = os.stat(file)
+    except FileNotFoundError:
+        logging.exception('Did not find the specified input file %s', file)
+        raise FileNotFoundError(file) from None
+    logging.debug('Found input file %s', file)
+    return file_stat
 
-    if filters is not None:
-        logging.warning('Filters have been specified. However the script does not check if these filters are actually '
-                        'available in the default locations used by pandoc.')
 
-    if metafile is not None and pathlib.Path(metafile).exists():
-        logging.debug('Found input file {}'.format(metafile))
-    elif metafile is not None and pathlib.Path(metafile).exists() is not True:
-        logging.exception('Did not find the specified input file {}'.format(metafile))
-        raise FileNotFoundError
-    elif metafile is None:
+def check_files(cfg):
+    """
+    Function to check if specified files exist.
+
+    :param cfg: Parameters for the script from parse_config().
+    :return: List with the modification times of the bibliography, CSL and metadata files, followed by a list with the
+     modification times of the filters. The modification time for the metadata file is None if it is not specified,
+     and the modification time for a filter is None if it is not found in the target directory.
+    """
+    filter_mtimes = []
+    if cfg.filters is not None:
+        for name in cfg.filters[0].split(','):
+            # pandoc runs in the target directory, so a filter found there is the one that pandoc will use. The
+            # modification times are part of the cache key, so that editing a filter invalidates the cached output.
+            try:
+                filter_mtimes.append(os.stat(os.path.join(str(cfg.target_files), name)).st_mtime_ns)
+            except FileNotFoundError:
+                logging.warning('Did not find the filter %s in the target directory. The script does not check if it '
+                                'is available in the pandoc user directory, and changes to it will not be picked up '
+                                'by the cache.', name)
+                filter_mtimes.append(None)
+
+    metafile_mtime = None
+    if cfg.metafile is not None:
+        metafile_mtime = check_file(cfg.metafile).st_mtime_ns
+    else:
         logging.debug('Skipping checks for metadata file as it not specified.')
 
-    for file in filelist:
-        if pathlib.Path(file).exists():
-            logging.debug('Found input file {}'.format(file))
-        else:
-            logging.exception('Did not find the specified input file {}'.format(file))
-            raise FileNotFoundError
+    return [check_file(cfg.bib_file).st_mtime_ns, check_file(cfg.csl_file).st_mtime_ns, metafile_mtime, filter_mtimes]
+
+
+def open_cache(temp_dir):
+    """
+    Function to open the cache of pandoc output. The cache is a SQLite database stored in the resources directory and
+    holds the last pandoc output for every source markdown file.
+
+    :param temp_dir: Path to directory where the cache should be stored.
+    :return: Connection to the cache database.
+    """
+    cache_file = pathlib.Path.joinpath(temp_dir, 'zettel_cache.sqlite')
+    logging.debug('Using cache file %s', cache_file)
+    cache = sqlite3.connect(os.fspath(cache_file))
+    cache.execute('CREATE TABLE IF NOT EXISTS pandoc_output (name TEXT PRIMARY KEY, key TEXT NOT NULL, '
+                  'output TEXT NOT NULL)')
+    return cache
+
+
+def cache_key(file, base_args, mtimes):
+    """
+    Function to generate the cache key for a markdown file. The key will change if the contents of the file, the
+    modification time of the bibliography, CSL, metadata or filter files, or any of the pandoc parameters change.
+
+    :param file: Input markdown file to be processed by pandoc.
+    :param base_args: List of pandoc parameters from pandoc_args().
+    :param mtimes: Modification times of the bibliography, CSL, metadata and filter files from check_files().
+    :return: Hex digest of the file contents and pandoc parameters.
+    """
+    digest = hashlib.blake2b(file.read_bytes())
+    digest.update(repr((mtimes, base_args)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_cache(cache, file, key):
+    """
+    Function to look up the pandoc output for a markdown file in the cache.
+
+    :param cache: Connection to the cache database.
+    :param file: Input markdown file to be processed by pandoc.
+    :param key: Cache key for the current version of the file from cache_key().
+    :return: String containing the cached pandoc output or None if the file needs to be processed by pandoc.
+    """
+    row = cache.execute('SELECT output FROM pandoc_output WHERE name = ? AND key = ?',
+                        (file.name, key)).fetchone()
+    if row is None:
+        return None
+    logging.debug('Found cached pandoc output for %s', file)
+    return row[0]
+
+
+def update_cache(cache, file, key, output):
+    """
+    Function to save the pandoc output for a markdown file in the cache, replacing any earlier output for the file.
+
+    :param cache: Connection to the cache database.
+    :param file: Input markdown file that was processed by pandoc.
+    :param key: Cache key for the current version of the file from cache_key().
+    :param output: String containing the output generated by pandoc.
+    :return: None
+    """
+    with cache:
+        cache.execute('INSERT OR REPLACE INTO pandoc_output (name, key, output) VALUES (?, ?, ?)',
+                      (file.name, key, output))
     return None
 
 
-def run_pandoc(file, process_images, img_input_dir, img_output_dir, filters, bibfile, cslfile, metafile, temp_dir,
-               target_dir):
+def pandoc_args(cfg):
     """
-    Function to process markdown files in the source directory with pandoc to add complete citations and optionally
-    extract & rewrite images and/or add additional YAML metadata.
+    Function to generate the pandoc parameters to add complete citations and optionally extract & rewrite images and/or
+    add additional YAML metadata.
 
-    :param file: Input markdown file to be processed by pandoc. Will be supplied by process_files() in a loop.
-    :param process_images: Flag for whether images should be processed by the script
-    :param img_input_dir: Directory path(s) where images linked in source markdown files are stored.
-    :param img_output_dir: Directory to store images after they are extracted from source markdown files.
-    :param filters: List of Pandoc LUA filters to be included when running pandoc.
-    :param bibfile: Path to bibliography file.
-    :param cslfile: Path to Citation Language Style file.
-    :param metafile: Path to YAML file containing optional additional metadata.
-    :param temp_dir:  Path to directory where temporary output file should be stored.
-    :param target_dir: Directory to store markdown files after they are processed.
-    :return: Complete path to intermediate output file in Multi-Markdown format generated by pandoc.
+    :param cfg: Parameters for the script from parse_config().
+    :return: List of pandoc parameters, excluding the input and output files.
     """
 
     # Generate pandoc filter list based on availability of filter parameter.
-    filterlist = None
-    if filters is not None:
-        filterlist = ''.join([' --lua-filter="{}"'.format(value) for value in filters[0].split(',')])
+    filterlist = []
+    if cfg.filters is not None:
+        filterlist = ['--lua-filter={}'.format(value) for value in cfg.filters[0].split(',')]
     else:
         logging.debug('Skipping filter parameters since no filters have been defined.')
 
     # We cannot use the same approach that we use for filters to get the list of resource paths for images, i.e:
-    # img_inputdir_list = ''.join([' --resource-path=.;{}'.format(value) for value in img_input_dir[0].split(',')])
-    # Multiple invocations of --resource-path will result in only the last directory being considered. In addition
-    # to specify fully quoted paths, we must use escaped slash characters in Windows.
-    # This requires a OS-specific approach due to path separator & environment separator differences.
+    # img_inputdir_list = ['--resource-path=.;{}'.format(value) for value in cfg.img_inputs[0].split(',')]
+    # Multiple invocations of --resource-path will result in only the last directory being considered. Instead the
+    # directories are joined with the OS-specific search path separator (':' or ';').
     img_inputdir = None
-    if process_images == 'yes' and sys.platform != 'win32':
-        img_input_dir[:] = [i.replace(',', ':"') for i in img_input_dir]
-        img_inputdir_list = img_input_dir[0]
-        img_inputdir_str = ' --resource-path=.:"' + img_inputdir_list
-        img_inputdir_str = img_inputdir_str.replace('/:', '/":')
-        img_inputdir = img_inputdir_str + '"'
-    elif process_images == 'yes' and sys.platform == 'win32':
-        img_input_dir[:] = [i.replace(',', ';"') for i in img_input_dir]
-        img_inputdir_list = img_input_dir[0]
-        img_inputdir_str = ' --resource-path=.;"' + img_inputdir_list
-        img_inputdir_str = img_inputdir_str.replace('\\', '\\\\')
-        img_inputdir_str = img_inputdir_str.replace('\\\\;', '\\\\";')
-        img_inputdir = img_inputdir_str + '"'
-    elif process_images == 'no':
+    if cfg.process_images == 'yes':
+        img_inputdir = '--resource-path=' + os.pathsep.join(['.'] + cfg.img_inputs[0].split(','))
+    elif cfg.process_images == 'no':
         logging.debug('Skipping image input directories parameter since images processing is set to no.')
 
     metadata_file = None
-    if metafile is not None:
-        metafile_str = metafile.replace('\\', '\\\\')
-        metadata_file = '--metadata-file="' + metafile_str + '"'
+    if cfg.metafile is not None:
+        metadata_file = '--metadata-file=' + os.path.abspath(cfg.metafile)
     else:
         logging.debug('Skipping additional metadata file parameter since no input file has been specified.')
 
     img_output_path = None
-    if process_images == 'yes':
-        img_output_name = pathlib.Path(img_output_dir).name
+    if cfg.process_images == 'yes':
+        img_output_name = pathlib.Path(cfg.img_output).name
         img_output_path = '--extract-media=/' + img_output_name
-    elif process_images == 'no':
+    elif cfg.process_images == 'no':
         logging.debug('Skipping image output directories parameter since images processing is set to no.')
 
-    bibfile_str = bibfile.replace('\\', '\\\\')
-    cslfile_str = cslfile.replace('\\', '\\\\')
-    inputfile_str = str(file)
-    inputfile_str = inputfile_str.replace('\\', '\\\\')
-    bibliography = '--bibliography="' + bibfile_str + '"'
-    csl = '--csl="' + cslfile_str + '"'
-    inputfile = '"' + inputfile_str + '"'
-    # os.remove('outfile.md')
-    # pathlib.Path.unlink(pathlib.Path.joinpath(temp_dir, 'outfile.md'))
-    tempdir_str = str(temp_dir)
-    tempdir_str = tempdir_str.replace('\\', '\\\\')
-    outfile = '-o ' + '"' + tempdir_str + "\\" + 'outfile.md"'
-
-    # This is not a recommended practice, but pandoc needs to be running in the eventual output folder for image
-    # extraction to work reliably.
-    os.chdir(target_dir)
-
-    # Run pandoc for different combinations of process_images, metadata_file & filter availability:
-
-    logging.debug('Start processing {} with pandoc'.format(file))
-    if process_images == 'yes' and metadata_file is not None and filterlist is not None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', img_inputdir, img_output_path, filterlist,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc', metadata_file,
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'yes' and metadata_file is not None and filterlist is None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', img_inputdir, img_output_path,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc', metadata_file,
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'yes' and metadata_file is None and filterlist is not None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', img_inputdir, img_output_path, filterlist,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc',
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'yes' and metadata_file is None and filterlist is None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', img_inputdir, img_output_path,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc',
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'no' and metadata_file is not None and filterlist is not None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', filterlist,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc', metadata_file,
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'no' and metadata_file is not None and filterlist is None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone',
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc', metadata_file,
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'no' and metadata_file is None and filterlist is not None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone', filterlist,
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc',
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    if process_images == 'no' and metadata_file is None and filterlist is None:
-        with Sultan.load(logging=False) as s:
-            result = s.pandoc(inputfile, '-f markdown', '--standalone',
-                              '--wrap=preserve', '--markdown-headings=atx', '--citeproc',
-                              '--metadata=suppress-bibliography', '-t markdown_mmd+yaml_metadata_block', bibliography,
-                              csl, outfile).run()
-            logging.debug('Pandoc command execution Status: {} and '.format(result.rc) +
-                          'command output: {}'.format(result.stdout + result.stderr))
-
-    # Due to a known bug with Sultan (https://github.com/aeroxis/sultan/issues/64), the output file could have ";"
-    # appended to the filename on Windows. Hence, we will check for both variants before returning the output file name.
-    tempfile = pathlib.Path.joinpath(temp_dir, 'outfile.md')
-    if pathlib.Path(tempfile).exists():
-        return tempfile
-    elif pathlib.Path(pathlib.Path.joinpath(temp_dir, 'outfile.md;')).exists():
-        tempfile = pathlib.Path.joinpath(temp_dir, 'outfile.md;')
-        return tempfile
+    # pandoc is run directly rather than through a shell, so paths are passed as-is without any quoting or escaping.
+    # pandoc runs in the target directory, so paths are made absolute in case they were specified relative to the
+    # current directory.
+    bibliography = '--bibliography=' + os.path.abspath(cfg.bib_file)
+    csl = '--csl=' + os.path.abspath(cfg.csl_file)
+
+    # Parameters which are not in use for this run are None and are dropped.
+    args = ['-f', 'markdown', '--standalone', img_inputdir, img_output_path, *filterlist, '--wrap=preserve',
+            '--markdown-headings=atx', '--citeproc', metadata_file, '--metadata=suppress-bibliography',
+            '-t', 'markdown_mmd+yaml_metadata_block', bibliography, csl]
+    return [arg for arg in args if arg is not None]
+
+
+def run_pandoc(file, base_args, target_dir):
+    """
+    Function to process markdown files in the source directory with pandoc.
+
+    :param file: Input markdown file to be processed by pandoc. Will be supplied by process_file().
+    :param base_args: List of pandoc parameters from pandoc_args().
+    :param target_dir: Directory to store markdown files after they are processed.
+    :return: String containing the output in Multi-Markdown format generated by pandoc.
+    """
+    # pandoc needs to be running in the eventual output folder for image extraction to work reliably. We set the
+    # working directory of the pandoc process only, rather than changing directory in the script.
+    # The output is read from pandoc's stdout rather than an intermediate output file, which saves writing, re-reading
+    # and deleting a file for every markdown file. It is decoded here so that line endings are kept as-is.
+    logging.debug('Start processing %s with pandoc', file)
+    result = subprocess.run(['pandoc', os.path.abspath(file), *base_args], capture_output=True,
+                            cwd=os.fspath(target_dir))
+    stderr_text = result.stderr.decode('utf-8', errors='replace')
+    logging.debug('Pandoc command execution Status: %s and command output: %s', result.returncode, stderr_text)
+
+    if result.returncode == 0:
+        return result.stdout.decode('utf-8')
     else:
-        logging.exception('Could not find the temporary output file {}'.format(tempfile))
-        raise FileNotFoundError
+        logging.error('pandoc could not process the file %s: %s', file, stderr_text)
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
 
 
-def modify_links(file_obj):
+def split_code(text):
     """
-    Function will parse contents of intermediate output file generated by pandoc (opened in utf-8 mode) and modify
-    standalone [[wikilinks]] with different combinations of escaped characters and in-line [[wikilinks]](wikilinks)
-    (again with different combinations of escape characters) into Hugo link syntax using relref cross-references.
+    Function will split text into fenced code blocks, inline code snippets and the remaining text. A ``` fence extends
+    to the next ``` and a single backtick to the next backtick. A ``` with no closing fence is treated as backticks for
+    inline code instead and a backtick with no closing backtick is treated as text.
 
-    :param file_obj: Path to file
-    :return: String containing modified text. Newlines will be returned as '\\n' in the string.
+    :param text: String containing markdown text.
+    :return: List of (is_code, chunk) tuples which will return the original text when the chunks are joined together.
     """
+    chunks = []
+    start = 0
+    position = text.find('`')
+    while position != -1:
+        end = -1
+        if text.startswith('```', position):
+            end = text.find('```', position + 3)
+            if end != -1:
+                end += 3
+        if end == -1:
+            end = text.find('`', position + 1)
+            if end == -1:
+                break
+            end += 1
+        chunks.append((False, text[start:position]))
+        chunks.append((True, text[position:end]))
+        start = end
+        position = text.find('`', end)
+    chunks.append((False, text[start:]))
+    return chunks
+
+
+def replace_citations(text):
+    """
+    Function to rewrite references in style [\\[123\\]] to [123].
 
-    file = file_obj
-    logging.debug('Going to start processing {}.'.format(file))
-    try:
-        with open(file, encoding="utf8") as infile:
-            content = infile.read()
-            # Read the entire file as a single string
-            firstpass = regex.sub(r'(?V1)'
-                                  r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-                                  # Ignore fenced & inline code blocks. V1 engine allows in-line flags so we 
-                                  # enable newline matching only here. 
-                                  # r'|(\ {4}|\t).*(*SKIP)(*FAIL)      
-                                  # We cannot support skipping code blocks beginning with 4 spaces/1 tab 
-                                  # as pandoc conversion changes Note-Link-Janitor links to use 4 spaces. 
-                                  r'|(\\\[\\\[(.*)\\\]\\\](?!\s\(|\())', r'[\2]({{< relref "\2.md" >}})', content)
-            # Finds  references that are in style \[\[foo\]\] only by excluding links in style \[\[foo\]\](bar) or
-            # \[\[foo\]\] (bar). Capture group $2 returns just foo
-            secondpass = regex.sub(r'(?V1)'
-                                   r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-                                   # Ignore fenced & inline code blocks. V1 engine allows in-line flags so we enable 
-                                   # newline matching only here. 
-                                   # r'|(\ {4}|\t).*(*SKIP)(*FAIL) 
-                                   # We cannot support skipping code blocks beginning with 4 spaces/1 tab as pandoc 
-                                   # conversion changes Note-Link-Janitor links to use 4 spaces. 
-                                   r'|(\[\\\[(\d+)\\\]\])', r'[\2]', firstpass)
-            # Finds references that are in style [\[123\]] only. Capture Group $2 returns just 123.
-            thirdpass = regex.sub(r'(?V1)'
-                                  r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-                                  # Ignore fenced & inline code blocks. V1 engine allows in-line flags so
-                                  # we enable newline matching only here. 
-                                  # r'|(\ {4}|\t).*(*SKIP)(*FAIL)'
-                                  # We cannot support skipping code blocks beginning with 4 spaces/1 tab as pandoc  
-                                  # conversion changes Note-Link-Janitor links to use 4 spaces.   
-                                  r'|(\%20+(?=[^(\)]*\)))', r' ', secondpass)
-            # Finds references that are in style (foo%20bar) only and changes it to (foo bar).
-            fourthpass = regex.sub(r'(?V1)'
-                                   r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-                                   # Ignore fenced & inline code blocks. V1 engine allows in-line flags so
-                                   # we enable newline matching only here.
-                                   # r'|(\ {4}|\t).*(*SKIP)(*FAIL)'
-                                   # We cannot support skipping code blocks beginning with 4 spaces/1 tab as pandoc  
-                                   # conversion changes Note-Link-Janitor links to use 4 spaces.   
-                                   r'|(\[(\d+)\](\()(.*)(?=\))\))', r'[\2 \4]({{< relref "\2 \4.md" >}})', thirdpass)
-            # Finds only references in style [123](bar). Capture group $2 returns 123 and capture
-            # group $4 returns bar
-            finalpass = regex.sub(r'(?V1)'
-                                  r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-                                  # Ignore fenced & inline code blocks. V1 engine allows in-line flags so
-                                  # we enable newline matching only here.
-                                  # r'|(\ {4}|\t).*(*SKIP)(*FAIL)'
-                                  # We cannot support skipping code blocks beginning with 4 spaces/1 tab as pandoc  
-                                  # conversion changes Note-Link-Janitor links to use 4 spaces.   
-                                  r'|(\\\[\\\[(\d+)\\\]\\\](\s\(|\()(.*)\))', r'[\2 \4]({{< relref "\2 \4.md" >}})',
-                                  fourthpass)
-            # Finds only references in style \[\[123\]\] (bar). Capture group $2 returns 123 and capture
-            # group $4 returns bar
-            # print(finalpass)
-    except EnvironmentError:
-        logging.exception('Unable to open file {} for reading'.format(file))
-    logging.debug('Finished processing {}'.format(file))
+    :param text: String containing text outside of code blocks.
+    :return: String with the references rewritten.
+    """
+    parts = []
+    last = 0
+    start = text.find('[\\[')
+    while start != -1:
+        end = start + 3
+        while end < len(text) and text[end].isdecimal():
+            end += 1
+        if end > start + 3 and text.startswith('\\]]', end):
+            parts.append(text[last:start])
+            parts.append('[' + text[start + 3:end] + ']')
+            last = end + 3
+            start = text.find('[\\[', last)
+        else:
+            start = text.find('[\\[', start + 1)
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+def replace_url_spaces(text):
+    """
+    Function to change references in style (foo%20bar) to (foo bar). A %20 is only replaced if the next bracket after it
+    is a closing bracket.
+
+    :param text: String containing text outside of code blocks.
+    :return: String with %20 replaced by spaces.
+    """
+    parts = []
+    last = 0
+    start = text.find('%20')
+    while start != -1:
+        end = start + 3
+        while text.startswith('0', end):
+            end += 1
+        close = text.find(')', end)
+        if close == -1:
+            # No closing bracket is left, so none of the remaining %20 can be replaced either.
+            break
+        bracket = text.find('(', end, close)
+        if bracket == -1:
+            parts.append(text[last:start])
+            parts.append(' ')
+            last = end
+            start = text.find('%20', end)
+        else:
+            # Every %20 before the opening bracket is followed by it as well, so the search continues after it.
+            start = text.find('%20', bracket)
+    parts.append(text[last:])
+    return ''.join(parts)
+
+
+def wikilink_relref(match):
+    """
+    Function to rewrite a link in style \\[\\[foo\\]\\] found by _WIKILINK_RE into Hugo link syntax.
+
+    :param match: Match object for the link.
+    :return: String containing the link as a relref cross-reference.
+    """
+    name = match.group(2)
+    return '[' + name + ']({{< relref "' + name + '.md" >}})'
+
+
+def numbered_relref(match):
+    """
+    Function to rewrite a link in style [123](bar) or \\[\\[123\\]\\] (bar) found by _NUMBERED_LINK_RE or
+    _NUMBERED_WIKILINK_RE into Hugo link syntax.
+
+    :param match: Match object for the link.
+    :return: String containing the link as a relref cross-reference.
+    """
+    name = match.group(2) + ' ' + match.group(4)
+    return '[' + name + ']({{< relref "' + name + '.md" >}})'
+
+
+def modify_links(content, file):
+    """
+    Function will parse the output generated by pandoc and modify standalone [[wikilinks]] with different combinations
+    of escaped characters and in-line [[wikilinks]](wikilinks) (again with different combinations of escape
+    characters) into Hugo link syntax using relref cross-references.
+
+    :param content: String containing the output generated by pandoc for a markdown file.
+    :param file: Path to source file. Only used for logging.
+    :return: String containing modified text. Line endings are kept as they are in the pandoc output.
+    """
+    logging.debug('Going to start processing %s.', file)
+    # Every link style handled below needs either [\[ (which is also part of \[\[), %20 or ]( to be present in the
+    # text, so files without any of them can be returned as-is without running the regexes.
+    if '[\\[' not in content and '%20' not in content and '](' not in content:
+        logging.debug('No links found in %s. Skipping link processing.', file)
+        return content
+    chunks = []
+    for is_code, chunk in split_code(content):
+        # Ignore fenced & inline code blocks.
+        if not is_code:
+            # Each pass works on the output of the previous one, e.g. [\[123\]](foo%20bar) only becomes a relref link
+            # after the citation and %20 passes have run. So instead of scanning every chunk five times, a pass is
+            # skipped when the text it needs is not in the chunk as it stands at that point.
+            if '\\[\\[' in chunk:
+                chunk = _WIKILINK_RE.sub(wikilink_relref, chunk)
+            if '[\\[' in chunk:
+                chunk = replace_citations(chunk)
+            if '%20' in chunk:
+                chunk = replace_url_spaces(chunk)
+            if '](' in chunk:
+                chunk = _NUMBERED_LINK_RE.sub(numbered_relref, chunk)
+            if '\\[\\[' in chunk:
+                chunk = _NUMBERED_WIKILINK_RE.sub(numbered_relref, chunk)
+        chunks.append(chunk)
+    finalpass = ''.join(chunks)
+    logging.debug('Finished processing %s', file)
     return finalpass
 
 
@@ -548,78 +693,208 @@ def write_file(file_contents, file, target_dir):
     :return: Full path to file that was written to target directory.
     """
 
-    name = pathlib.Path(file).name
-    fullpath = pathlib.Path(target_dir).joinpath(name)
-    logging.debug('Going to write file {} now.'.format(fullpath))
+    fullpath = target_dir.joinpath(file.name)
+    logging.debug('Going to write file %s now.', fullpath)
     try:
-        with open(fullpath, 'w', encoding="utf8") as outfile:
-            for item in file_contents:
-                outfile.write("%s" % item)
+        fullpath.write_bytes(file_contents.encode('utf-8'))
     except EnvironmentError:
-        logging.exception('Unable to write contents to {}'.format(fullpath))
+        logging.exception('Unable to write contents to %s', fullpath)
 
-    logging.debug('Finished writing file {} now.'.format(fullpath))
+    logging.debug('Finished writing file %s now.', fullpath)
     return fullpath
 
 
-def process_files(temp_dir, source_dir, target_dir, process_images, img_input_dir, img_output_dir, filters, bibfile,
-                  cslfile,
-                  metafile, process_type, modified_time):
+def process_file(file, output, base_args, target_dir, skip_errors=False):
     """
-    Function to process input files. Will operate in a loop on all files (process "all")
-    or recently modified files (process "modified")
+    Function to process a single markdown file. The file is converted by pandoc, links in the pandoc output are
+    rewritten and the result is written to the target directory.
+
+    :param file: Input markdown file to be processed. Will be supplied by process_files() from a process pool.
+    :param output: String containing the cached pandoc output for the file, or None if the file needs to be converted
+     by pandoc.
+    :param base_args: List of pandoc parameters from pandoc_args().
+    :param target_dir: Directory to store markdown files after they are processed.
+    :param skip_errors: Flag for whether a file which pandoc could not process should be skipped instead of stopping
+     the script.
+    :return: String containing the pandoc output for the file, so that it can be saved in the cache by process_files().
+     Returns None if the file was skipped.
+    """
+    if output is None:
+        try:
+            output = run_pandoc(file, base_args, target_dir)
+        except subprocess.CalledProcessError:
+            if not skip_errors:
+                raise
+            # run_pandoc() has already logged the error from pandoc.
+            logging.warning('Skipping %s until it is modified again.', file)
+            return None
+    modified_text = modify_links(output, file)
+    write_file(modified_text, file, target_dir)
+    return output
+
+
+def find_files(source_dir, cutoff=None):
+    """
+    Function to list the markdown files with a .md extension in the source directory.
 
-    :param temp_dir:  Path to directory where temporary output file should be stored.
     :param source_dir: Path to directory containing source markdown files to be processed.
+    :param cutoff: Optional timestamp. If specified, only files modified after this time are returned.
+    :return: List of paths to markdown files.
+    """
+    # Sub-directories are not descended into since that may have unexpected side-effects
+    with os.scandir(source_dir) as entries:
+        return [pathlib.Path(entry.path) for entry in entries
+                if fnmatch.fnmatch(entry.name, '*.md') and entry.is_file() and
+                (cutoff is None or entry.stat().st_mtime > cutoff)]
+
+
+def init_worker(level, log_file):
+    """
+    Function to set up a process in the process pool. Worker processes log with the same level and to the same log file
+    as the script, and leave handling Ctrl+C to the main process, which stops the script cleanly when it is watching
+    for modified files.
+
+    :param level: Logging level of the script.
+    :param log_file: Path to log file, or None if no log file is set.
+    :return: None
+    """
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    # Workers which are forked from the script already have its handlers, but workers which are started fresh (e.g. on
+    # Windows and macOS) do not.
+    if log_file is not None and not any(isinstance(handler, logging.FileHandler) and
+                                        handler.baseFilename == os.path.abspath(log_file)
+                                        for handler in logger.handlers):
+        add_file_logger(log_file)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def convert_files(files, executor, cache, base_args, target_dir, mtimes, skip_errors=False):
+    """
+    Function to process a list of markdown files in the process pool. The pandoc output is taken from the cache for
+    files which have not changed since they were last processed.
+
+    :param files: List of paths to markdown files from find_files().
+    :param executor: Process pool to run process_file() in.
+    :param cache: Connection to the cache database, or None if the cache is not in use.
+    :param base_args: List of pandoc parameters from pandoc_args().
     :param target_dir: Path to directory where markdown files should be written to after processing.
-    :param process_images: Flag for whether images should be processed by the script
-    :param img_input_dir: Directory path(s) where images linked in source markdown files are stored.
-    :param img_output_dir: Directory to store images after they are extracted from source markdown files.
-    :param filters: List of Pandoc LUA filters to be included when running pandoc.
-    :param bibfile: Path to bibliography file.
-    :param cslfile: Path to Citation Language Style file.
-    :param metafile: Path to YAML file containing optional additional metadata.
-    :param process_type: Flag to process all or only modified files.
-    :param modified_time: Time window for finding recently modified files.
+    :param mtimes: Modification times of the bibliography, CSL, metadata and filter files from check_files().
+    :param skip_errors: Flag for whether files which pandoc could not process should be skipped instead of stopping
+     the script.
+    :return: Number of files processed.
+    """
+    count = 0
+
+    # Files which have not changed since the last run are taken from the cache. Only the remaining files need to be
+    # converted by pandoc.
+    keys = {}
+    outputs = []
+    for file in files:
+        output = None
+        if cache is not None:
+            key = cache_key(file, base_args, mtimes)
+            output = read_cache(cache, file, key)
+            if output is None:
+                keys[file] = key
+        outputs.append(output)
+
+    # Each file is independent of the others, so running pandoc, rewriting links and writing the results all happen
+    # concurrently. Only the cache is updated here since the database connection cannot be shared between processes.
+    process = functools.partial(process_file, base_args=base_args, target_dir=target_dir, skip_errors=skip_errors)
+    for file, output in zip(files, executor.map(process, files, outputs)):
+        if output is None:
+            continue
+        count += 1
+        if file in keys:
+            update_cache(cache, file, keys[file], output)
+
+    return count
+
+
+def watch_files(source_dir, interval, convert, last_check):
+    """
+    Function to keep processing markdown files in the source directory as they are modified, until the script is stopped
+    with Ctrl+C. The directory is checked for modified files every few seconds.
+
+    :param source_dir: Path to directory containing source markdown files to be processed.
+    :param interval: Time in seconds between checks for modified files.
+    :param convert: Function which processes a list of files and returns the number of files processed.
+    :param last_check: Time when the source directory was last read. Files modified after this time are processed.
     :return: Number of files processed.
     """
     count = 0
+    logging.info('Watching %s for modified markdown files. Press Ctrl+C to stop.', source_dir)
+    try:
+        while True:
+            time.sleep(interval)
+            # The time is taken before reading the directory, so files modified while the directory is being read are
+            # picked up again by the next check rather than missed.
+            now = time.time()
+            files = find_files(source_dir, last_check)
+            last_check = now
+            if files:
+                logging.info('Found %s modified markdown files in %s', len(files), source_dir)
+                count += convert(files, skip_errors=True)
+    except KeyboardInterrupt:
+        logging.info('Stopped watching %s', source_dir)
+
+    return count
+
 
-    if process_type == 'all':
-        logging.info('Start processing all markdown files with .md extension in {}'.format(source_dir))
-        for count, file in enumerate(pathlib.Path(source_dir).glob('*.md'), start=1):
-            # We will not use iterdir() here since that will descend into sub-directories which may have
-            # unexpected side-effects
-            tempfile = run_pandoc(file, process_images, img_input_dir, img_output_dir, filters, bibfile, cslfile,
-                                  metafile, temp_dir, target_dir)
-            modified_text = modify_links(tempfile)
-            write_file(modified_text, file, target_dir)
-    elif process_type == 'modified':
-        logging.info('Start processing recently modified markdown files with .md extension in {}'.format(source_dir))
-        for count, file in enumerate(pathlib.Path(source_dir).glob('*.md'), start=1):
-            if pathlib.Path(file).stat().st_mtime > time.time() - modified_time * 60:
-                tempfile = run_pandoc(file, process_images, img_input_dir, img_output_dir, filters, bibfile, cslfile,
-                                      metafile, temp_dir, target_dir)
-                modified_text = modify_links(tempfile)
-                write_file(modified_text, file, target_dir)
-    logging.info('Finished processing all files in {}'.format(source_dir))
+def process_files(cfg, temp_dir, mtimes):
+    """
+    Function to process input files. Will operate in a loop on all files (process "all")
+    or recently modified files (process "modified"). With process "watch", all files are processed and then files are
+    processed as they are modified until the script is stopped.
+
+    :param cfg: Parameters for the script from parse_config().
+    :param temp_dir: Path to directory where the cache of pandoc output should be stored.
+    :param mtimes: Modification times of the bibliography, CSL, metadata and filter files from check_files().
+    :return: Number of files processed.
+    """
+    source_dir = str(cfg.source_files)
+    # The target directory is wrapped in a Path once here, rather than again for every file written to it.
+    target_dir = pathlib.Path(cfg.target_files)
+
+    # In watch mode, files modified while all files are first processed are picked up by the first check.
+    start_time = time.time()
+    if cfg.process_type in ('all', 'watch'):
+        logging.info('Start processing all markdown files with .md extension in %s', source_dir)
+        files = find_files(source_dir)
+    elif cfg.process_type == 'modified':
+        logging.info('Start processing recently modified markdown files with .md extension in %s', source_dir)
+        files = find_files(source_dir, time.time() - cfg.modified_time * 60)
+    else:
+        files = []
+
+    base_args = pandoc_args(cfg)
+    # pandoc only extracts images while it runs, so a cached file would never have its images written out.
+    if cfg.use_cache == 'yes' and cfg.process_images == 'yes':
+        logging.debug('Not using the cache since images are being extracted from the source markdown files')
+    cache = open_cache(temp_dir) if cfg.use_cache == 'yes' and cfg.process_images == 'no' else None
+    try:
+        with concurrent.futures.ProcessPoolExecutor(initializer=init_worker,
+                                                    initargs=(logging.getLogger().level, cfg.log_file)) as executor:
+            convert = functools.partial(convert_files, executor=executor, cache=cache, base_args=base_args,
+                                        target_dir=target_dir, mtimes=mtimes)
+            count = convert(files)
+            logging.info('Finished processing all files in %s', source_dir)
+            if cfg.process_type == 'watch':
+                count += watch_files(source_dir, cfg.watch_interval, convert, start_time)
+    finally:
+        if cache is not None:
+            cache.close()
 
     return count
 
 
 def main():
     start_time = time.perf_counter()
-    parameters = parse_config()
-    temp_dir = check_dirs(source_dir=str(parameters[1]), target_dir=str(parameters[2]),
-                          process_images=str(parameters[3]),
-                          img_input_dir=parameters[4], img_output_dir=str(parameters[5]))
-    check_files(filters=parameters[6], bibfile=str(parameters[8]), cslfile=str(parameters[9]),
-                metafile=parameters[10])
-    count = process_files(temp_dir, source_dir=str(parameters[1]), target_dir=str(parameters[2]),
-                          process_images=str(parameters[3]),
-                          img_input_dir=parameters[4], img_output_dir=parameters[5], filters=parameters[6],
-                          bibfile=str(parameters[8]), cslfile=str(parameters[9]), metafile=parameters[10],
-                          process_type=str(parameters[12]), modified_time=parameters[13])
+    cfg = parse_config()
+    temp_dir = check_dirs(cfg)
+    mtimes = check_files(cfg)
+    count = process_files(cfg, temp_dir, mtimes)
     end_time = time.perf_counter()
     elapsed_time = end_time - start_time
     hours, remainder = divmod(elapsed_time, 3600)
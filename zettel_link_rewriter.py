@@ -1,24 +1,66 @@
 #!/usr/bin/env python
 
+import concurrent.futures
+import fnmatch
+import functools
 import logging
+import os
 import pathlib
 import configargparse
 import regex
+import shutil
 import time
 import sys
 
+# Location of the script, used to find the default configuration file and directories
+_SCRIPT_PATH = pathlib.Path(__file__)
+_SCRIPT_STEM = _SCRIPT_PATH.stem
+_SCRIPT_DIR = _SCRIPT_PATH.parent
+
 # Configure logging early
 logging.basicConfig(level=logging.DEBUG,
                     format="%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s",
                     datefmt="%Y-%m-%d %H:%M:%S")
 
+# Patterns used by modify_links() are compiled once at import time rather than on every file. Both patterns ignore
+# fenced & inline code blocks first. Newline matching is enabled with scoped (?s:...) groups for the code blocks only,
+# so that the remaining alternatives still match within a single line.
+_WIKILINK_RE = regex.compile(r'(?s:```.*?```)(*SKIP)(*FAIL)|(?s:`.*?`)(*SKIP)(*FAIL)'
+                             r'|(\ {4}|\t).*(*SKIP)(*FAIL)'
+                             # Ignore code blocks beginning with 4 spaces/1 tab
+                             r'|(\[\[(.*)\]\](?!\s\(|\())', flags=regex.VERSION1)
+# Finds  references that are in style [[foo]] only by excluding links in style [[foo]](bar) or
+# [[foo]] (bar). Capture group $3 returns just foo
+_NUMBERED_WIKILINK_RE = regex.compile(r'(?s:```.*?```)(*SKIP)(*FAIL)|(?s:`.*?`)(*SKIP)(*FAIL)'
+                                      r'|(\ {4}).*(*SKIP)(*FAIL)'
+                                      # Ignore code blocks beginning with 4 spaces only. Tabs are not supported here
+                                      # since Note-Link-Janitor uses tabs for inline references.
+                                      r'|(\[\[(\d+)\]\](\s\(|\()(.*)(?=\))\))', flags=regex.VERSION1)
+# Finds only references in style [[123]](bar) or [[123]] (bar). Capture group $3 returns 123 and capture
+# group $5 returns bar
+
+
+def add_file_logger(log_file):
+    """
+    Function to add a handler to the root logger which writes log messages to a file.
+
+    :param log_file: Path to log file.
+    :return: None
+    """
+    filelogger = logging.FileHandler("{0}".format(log_file))
+    filelogformatter = logging.Formatter(
+        '%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s',
+        datefmt="%Y-%m-%d %H:%M:%S")
+    filelogger.setFormatter(filelogformatter)
+    logging.getLogger().addHandler(filelogger)
+
 
 def parse_config():
-    default_config = pathlib.Path(__file__).stem + ".ini"
+    default_config = _SCRIPT_STEM + ".ini"
     config = configargparse.ArgParser(default_config_files=[default_config])
     config.add_argument('-c', '--config', is_config_file=True,
                         help="Specify path to Configuration file. Default is {0}.ini".format(
-                            pathlib.Path(__file__).stem), metavar='CONFIG'
+                            _SCRIPT_STEM), metavar='CONFIG'
                         )
     config.add_argument('-v', '--verbosity', action='store',
                         help="Specify logging level for script. Default is %(default)s.",
@@ -29,12 +71,12 @@ def parse_config():
     config.add_argument('--source_files', action='store',
                         help="Specify path to directory containing source markdown files. Default is to use a "
                              "\"source\" folder in the current directory. ",
-                        default=pathlib.Path.joinpath(pathlib.Path(__file__).parent, "source"),
+                        default=pathlib.Path.joinpath(_SCRIPT_DIR, "source"),
                         metavar='DIRECTORY')
     config.add_argument('--target_files', action='store',
                         help="Specify path to directory where processed markdown files should be saved. Default is to "
                              "use a \"dest\" folder in the current directory. ",
-                        default=pathlib.Path.joinpath(pathlib.Path(__file__).parent, "dest"), metavar='DIRECTORY')
+                        default=pathlib.Path.joinpath(_SCRIPT_DIR, "dest"), metavar='DIRECTORY')
     config.add_argument('-p', '--process', action='store',
                         help="Determine whether to process all source files or only recently modified files. Default "
                              "is %(default)s.",
@@ -48,18 +90,17 @@ def parse_config():
         print('Script is being executed without any parameters and will use built-in defaults. Re-run script with -h '
               'parameter to understand options available.')
 
-    options = config.parse_known_args()
-    # Convert tuple of parsed arguments into a dictionary. There are two values within this tuple.
-    # [0] represents recognized arguments. [1] represents unrecognized arguments on command-line or config file.
-    option_values = vars(options[0])
-    # Assign dictionary values to variables.
-    config_file = option_values.get("config")
-    source_files = option_values.get("source_files")
-    target_files = option_values.get("target_files")
-    logging_level = option_values.get("verbosity")
-    log_file = option_values.get("file")
-    process_type = option_values.get("process")
-    modified_time = option_values.get("modified")
+    # parse_known_args() returns a tuple of two values. [0] is a Namespace with the recognized arguments.
+    # [1] represents unrecognized arguments on command-line or config file, which we ignore.
+    options, _ = config.parse_known_args()
+    # Assign option values to variables.
+    config_file = options.config
+    source_files = options.source_files
+    target_files = options.target_files
+    logging_level = options.verbosity
+    log_file = options.file
+    process_type = options.process
+    modified_time = options.modified
 
     # Reset logging levels as per config
     logger = logging.getLogger()
@@ -69,12 +110,7 @@ def parse_config():
     if log_file is None:
         logging.debug("No log file set. All log messages will print to Console only")
     else:
-        filelogger = logging.FileHandler("{0}".format(log_file))
-        filelogformatter = logging.Formatter(
-            '%(asctime)s %(levelname)-8s %(funcName)s():%(lineno)i:        %(message)s',
-            datefmt="%Y-%m-%d %H:%M:%S")
-        filelogger.setFormatter(filelogformatter)
-        logger.addHandler(filelogger)
+        add_file_logger(log_file)
         logging.warning("Outputting to log file")
 
     # Check if specified config file exists else bail
@@ -112,7 +148,7 @@ def check_dirs(source_dir, target_dir):
     """
     if pathlib.Path(source_dir).exists():
         pass
-    elif source_dir == str(pathlib.Path.joinpath(pathlib.Path(__file__).parent, "source")) and pathlib.Path(
+    elif source_dir == str(pathlib.Path.joinpath(_SCRIPT_DIR, "source")) and pathlib.Path(
             source_dir).exists():
         print('No source directory found in specified configuration file. Using default {} instead'.format(source_dir))
     else:
@@ -121,7 +157,7 @@ def check_dirs(source_dir, target_dir):
 
     if pathlib.Path(target_dir).exists():
         pass
-    elif target_dir == str(pathlib.Path.joinpath(pathlib.Path(__file__).parent, "dest")):
+    elif target_dir == str(pathlib.Path.joinpath(_SCRIPT_DIR, "dest")):
         print('No target directory found in specified configuration file. Using default {} instead'.format(target_dir))
         pathlib.Path(target_dir).mkdir(exist_ok=True)
         # exist_ok=True will function like mkdir -p so there is no need to wrap this in a try-except block.
@@ -132,42 +168,57 @@ def check_dirs(source_dir, target_dir):
     return [source_dir, target_dir]
 
 
+def wikilink_relref(match):
+    """
+    Function to rewrite a link in style [[foo]] found by _WIKILINK_RE into Hugo link syntax.
+
+    :param match: Match object for the link.
+    :return: String containing the link as a relref cross-reference.
+    """
+    name = match.group(3)
+    return '[' + name + ']({{< relref "' + name + '.md" >}})'
+
+
+def numbered_relref(match):
+    """
+    Function to rewrite a link in style [[123]](bar) or [[123]] (bar) found by _NUMBERED_WIKILINK_RE into Hugo link
+    syntax.
+
+    :param match: Match object for the link.
+    :return: String containing the link as a relref cross-reference.
+    """
+    name = match.group(3) + ' ' + match.group(5)
+    return '[' + name + ']({{< relref "' + name + '.md" >}})'
+
+
 def modify_links(file_obj):
     """
     Function will parse file contents (opened in utf-8 mode) and modify standalone [[wikilinks]] and in-line
     [[wikilinks]](wikilinks) into Hugo link syntax using relref cross-references.
 
     :param file_obj: Path to file
-    :return: String containing modified text. Newlines will be returned as '\\n' in the string.
+    :return: String containing modified text. Line endings are kept as they are in the file. Returns None if the
+     file does not contain any [[wikilinks]].
     """
 
     file = file_obj
     logging.debug("Going to start processing %s.", file)
     try:
-        with open(file, encoding="utf8") as infile:
-            line = infile.read()
-            # Read the entire file as a single string
-            linelist = regex.sub(r'(?V1)'
-                                 r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-            #                    Ignore fenced & inline code blocks. V1 engine allows in-line flags so 
-            #                    we enable newline matching only here.
-                                 r'|(\ {4}|\t).*(*SKIP)(*FAIL)'
-            #                    Ignore code blocks beginning with 4 spaces/1 tab
-                                 r'|(\[\[(.*)\]\](?!\s\(|\())', r'[\3]({{< relref "\3.md" >}})', line)
-            # Finds  references that are in style [[foo]] only by excluding links in style [[foo]](bar) or
-            # [[foo]] (bar). Capture group $3 returns just foo
-            linelist_final = regex.sub(r'(?V1)'
-                                       r'(?s)```.*?```(*SKIP)(*FAIL)(?-s)|(?s)`.*?`(*SKIP)(*FAIL)(?-s)'
-            #                          Refer comments above for this portion.
-                                       r'|(\ {4}).*(*SKIP)(*FAIL)'
-            #                          Ignore code blocks beginning with 4 spaces only. Tabs are not supported here 
-            #                          since Note-Link-Janitor uses tabs for inline references. 
-                                       r'|(\[\[(\d+)\]\](\s\(|\()(.*)(?=\))\))',
-                                       r'[\3 \5]({{< relref "\3 \5.md" >}})', linelist)
-            # Finds only references in style [[123]](bar) or [[123]] (bar). Capture group $3 returns 123 and capture
-            # group $5 returns bar
+        # Read the entire file as a single string
+        line = file.read_bytes().decode("utf-8")
     except EnvironmentError:
         logging.exception("Unable to open file %s for reading", file)
+        raise
+    if '[[' not in line:
+        # A plain substring search is much cheaper than the regex passes below. write_file() will copy the file as-is
+        # when there is nothing to rewrite.
+        logging.debug("No wikilinks found in %s.", file)
+        return None
+    linelist = _WIKILINK_RE.sub(wikilink_relref, line)
+    linelist_final = linelist
+    # The first pass leaves [[123]](bar) style links alone, so the second pass is only needed if [[ is still present.
+    if '[[' in linelist:
+        linelist_final = _NUMBERED_WIKILINK_RE.sub(numbered_relref, linelist)
     logging.debug("Finished processing %s", file)
     return linelist_final
 
@@ -177,18 +228,18 @@ def write_file(file_contents, file, target_dir):
     Function will take modified contents of file from modify_links() function and output to target directory. File
     extensions are preserved and file is written in utf-8 mode.
 
-    :param file_contents: String containing modified text.
+    :param file_contents: String containing modified text. If None, the source file is copied without changes.
     :param file: Path to source file. Will be used to construct target file name.
     :param target_dir: Path to destination directory
     :return: Full path to file that was written to target directory.
     """
-    name = pathlib.Path(file).name
-    fullpath = pathlib.Path(target_dir).joinpath(name)
+    fullpath = target_dir.joinpath(file.name)
     logging.debug("Going to write file %s now.", fullpath)
     try:
-        with open(fullpath, 'w', encoding="utf8") as outfile:
-            for item in file_contents:
-                outfile.write("%s" % item)
+        if file_contents is None:
+            shutil.copyfile(file, fullpath)
+        else:
+            fullpath.write_bytes(file_contents.encode("utf-8"))
     except EnvironmentError:
         logging.exception("Unable to write contents to %s", fullpath)
 
@@ -196,7 +247,53 @@ def write_file(file_contents, file, target_dir):
     return fullpath
 
 
-def process_files(source_dir, target_dir, process_type, modified_time):
+def process_file(file, target_dir):
+    """
+    Function to modify the links in a single file and write it to the target directory.
+
+    :param file: Path to file to be processed. Will be supplied by process_files() from a process pool.
+    :param target_dir: Path to directory where files should be written to after processing.
+    :return: Full path to file that was written to target directory.
+    """
+    modified_text = modify_links(file)
+    return write_file(modified_text, file, target_dir)
+
+
+def find_files(source_dir, cutoff=None):
+    """
+    Function to list the files in the source directory.
+
+    :param source_dir: Path to directory containing files to be processed.
+    :param cutoff: Optional timestamp. If specified, only files modified after this time are returned.
+    :return: List of paths to files.
+    """
+    # Sub-directories are not descended into since that may have unexpected side-effects
+    with os.scandir(source_dir) as entries:
+        return [pathlib.Path(entry.path) for entry in entries
+                if fnmatch.fnmatch(entry.name, '*.*') and entry.is_file() and
+                (cutoff is None or entry.stat().st_mtime > cutoff)]
+
+
+def init_worker(level, log_file):
+    """
+    Function to set up a process in the process pool. Worker processes log with the same level and to the same log file
+    as the script.
+
+    :param level: Logging level of the script.
+    :param log_file: Path to log file, or None if no log file is set.
+    :return: None
+    """
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    # Workers which are forked from the script already have its handlers, but workers which are started fresh (e.g. on
+    # Windows and macOS) do not.
+    if log_file is not None and not any(isinstance(handler, logging.FileHandler) and
+                                        handler.baseFilename == os.path.abspath(log_file)
+                                        for handler in logger.handlers):
+        add_file_logger(log_file)
+
+
+def process_files(source_dir, target_dir, process_type, modified_time, log_file):
     """
     Function to process input files. Will operate in a loop on all files (process "all")
     or recently modified files (process "modified")
@@ -205,23 +302,26 @@ def process_files(source_dir, target_dir, process_type, modified_time):
     :param target_dir: Path to directory where files should be written to after processing.
     :param process_type: Flag to process all or only modified files.
     :param modified_time: Time window for finding recently modified files.
+    :param log_file: Path to log file, or None if no log file is set.
     :return: Number of files processed.
     """
-    count = 0
+    # The target directory is wrapped in a Path once here, rather than again for every file written to it.
+    target_dir = pathlib.Path(target_dir)
 
     if process_type == 'all':
         logging.info("Start processing all files in %s", source_dir)
-        for count, file in enumerate(pathlib.Path(source_dir).glob('*.*'), start=1):
-            # We will not use iterdir() here since that will descend into sub-directories which may have
-            # unexpected side-effects
-            modified_text = modify_links(file)
-            write_file(modified_text, file, target_dir)
+        files = find_files(source_dir)
     elif process_type == 'modified':
         logging.info("Start processing recently modified files in %s", source_dir)
-        for count, file in enumerate(pathlib.Path(source_dir).glob('*.*'), start=1):
-            if pathlib.Path(file).stat().st_mtime > time.time() - modified_time * 60:
-                modified_text = modify_links(file)
-                write_file(modified_text, file, target_dir)
+        files = find_files(source_dir, time.time() - modified_time * 60)
+    else:
+        files = []
+
+    # Each file is independent of the others, so they are processed concurrently.
+    process = functools.partial(process_file, target_dir=target_dir)
+    with concurrent.futures.ProcessPoolExecutor(initializer=init_worker,
+                                                initargs=(logging.getLogger().level, log_file)) as executor:
+        count = len(list(executor.map(process, files)))
     logging.info("Finished processing all files in %s", source_dir)
 
     return count
@@ -232,7 +332,7 @@ def main():
     parameters = parse_config()
     check_dirs(source_dir=str(parameters[1]), target_dir=str(parameters[2]))
     count = process_files(source_dir=str(parameters[1]), target_dir=str(parameters[2]), process_type=parameters[4],
-                          modified_time=parameters[5])
+                          modified_time=parameters[5], log_file=parameters[3])
     end_time = time.perf_counter()
     elapsed_time = end_time - start_time
     hours, remainder = divmod(elapsed_time, 3600)